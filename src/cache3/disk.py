@@ -20,17 +20,24 @@ eviction policies by `evict_manager.register`.
 """
 
 import abc
+import functools
 import pickle
 import warnings
 import sys
+import os
 from contextlib import contextmanager
 from pathlib import Path
-from sqlite3.dbapi2 import Connection, Cursor, OperationalError
-from threading import local, get_ident
-from time import time as current, sleep
+from sqlite3.dbapi2 import Connection, Cursor, OperationalError, Row
+from threading import local, Lock
+from queue import LifoQueue, Empty, Full
+from time import time as current, sleep, monotonic
 from typing import Type, Optional, Dict, Any, List, Tuple, Callable, Iterable
-from os import makedirs, getpid, remove as rmfile, path as op
-from hashlib import md5
+from os import (
+    makedirs, getpid, urandom, open as os_open, remove as rmfile, replace as mvfile, path as op,
+    O_WRONLY, O_CREAT, O_EXCL
+)
+from hashlib import blake2b
+from io import BytesIO
 from .util import (
     cached_property, empty, lazy, Time, TG, Number, get_expire, memoize, Cache3Error, Cache3Warning
 )
@@ -57,15 +64,289 @@ _default_name: str = 'default.sqlite3'
 # Default evict policy
 _default_evict_policy: str = 'lru'
 # SQLite pragma configs
+# Under `journal_mode=wal`, `synchronous=NORMAL` is both fast and safe: commits
+# no longer wait on fsync, the WAL is only synced at checkpoint time, and the
+# database cannot be corrupted by a crash (only the latest commits may roll back).
+# The page cache and the memory map are sized for a working set of many small
+# blobs with hot keys, they are upper bounds and only grow on demand. The page
+# size and the auto vacuum mode only take effect on a new database.
 _default_pragmas: Dict[str, Any] = {
+    'page_size': 1 << 13,  # 8KB
     'auto_vacuum': 1,
-    'cache_size': 1 << 13,  # 8, 192 pages
+    'cache_size': -(1 << 16),  # 64MB (negative values are KiB)
     'journal_mode': 'wal',
     'threads': 4,  # SQLite work threads count
     'temp_store': 2,  # DEFAULT: 0 | FILE: 1 | MEMORY: 2
-    'mmap_size': 1 << 26,  # 64MB
-    'synchronous': 1,
+    'mmap_size': 1 << 30,  # 1GB
+    'synchronous': 'NORMAL',
+    'wal_autocheckpoint': 1000,  # pages
+    # truncate the WAL back to about one checkpoint worth of pages
+    'journal_size_limit': 1 << 23,  # 8MB
 }
+# Pragmas must be emitted ahead of the others, in this order. The page size
+# and the auto vacuum mode have to be set before the database file is written,
+# and some SQLite versions ignore `synchronous` when it is set before the
+# journal mode.
+_leading_pragmas: Tuple[str, ...] = ('page_size', 'auto_vacuum', 'journal_mode')
+# The `IN (...)` sizes used by `get_many`. Keys are padded up to one of these
+# shapes, so only a handful of distinct statements are ever prepared.
+_batch_shapes: Tuple[int, ...] = (1, 4, 16, 64, 256)
+# Count of distinct rows hit by `get` that triggers a write back of the
+# buffered access statistics
+_access_buffer_size: int = 1 << 9
+# Count of writes after which the row count is read again even if the local
+# estimate is below `max_size`, to account for the other processes' writes
+_length_check_interval: int = 1 << 8
+# Count of the short str / bytes and number keys whose serialized form is
+# memoized, the memo keeps them alive
+_key_cache_size: int = 1 << 12
+# Length of the longest str / bytes key memoized, the inline keys may be far
+# longer than the memo should pin
+_key_cache_max_length: int = 1 << 8
+# Exact key types that are memoized, their equal values always have the same
+# stored form. `bool` and containers are not, True == 1 and (1, ) == (1.0, )
+_scalar_key_types: frozenset = frozenset((str, bytes, int, float))
+# Flags of the temporary files, created as `open` would, but never reusing an
+# existing one. `mkstemp` creates owner only files, which the other users of a
+# shared directory can not read
+_temp_flags: int = O_WRONLY | O_CREAT | O_EXCL | getattr(os, 'O_BINARY', 0)
+# Count of the stored file signatures remembered by `PickleStore`
+_stored_cache_size: int = 1 << 14
+# Count of the idle read only connections kept by `SQLiteManager`, the
+# readers above it are closed once returned
+_reader_pool_size: int = 8
+# Bounds of the exponential backoff (seconds) between the retries of a
+# locked database
+_min_backoff: float = 0.0005
+_max_backoff: float = 0.05
+
+# Unique key of the cache rows, also the conflict target of upsert. NULL never
+# conflicts in an unique index, so the tag is split into whether it is NULL and
+# its value, a NULL tag can not collide with any real tag then
+_KEY_TAG: str = '`key`, `tag` IS NULL, IFNULL(`tag`, 0)'
+
+# SQL statements of the hot paths. They are module level constants, so every
+# call hands the very same objects to the connection statement cache.
+_SQL_CONFIG_GET: str = (
+    'SELECT `value` '
+    'FROM `info` '
+    'WHERE `key` = ?'
+)
+_SQL_CONFIG_SET: str = (
+    'INSERT INTO `info`(`key`, `value`) '
+    'VALUES (?, ?) '
+    'ON CONFLICT (`key`) '
+    'DO UPDATE SET `value` = ?'
+)
+_SQL_GET: str = (
+    'SELECT `rowid`, `value`, `expire`, `vf` '
+    'FROM `cache` '
+    'WHERE `key` = ? AND `tag` IS ?'
+)
+_SQL_UPSERT: str = (
+    'INSERT INTO `cache`('
+    '`key`, `kf`, `value`, `vf`, `tag`, `store`, `expire`, `access`, `access_count`'
+    ') VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0) '
+    f'ON CONFLICT ({_KEY_TAG}) DO UPDATE SET '
+    '`value` = excluded.`value`, '
+    '`vf` = excluded.`vf`, '
+    '`store` = excluded.`store`, '
+    '`expire` = excluded.`expire`, '
+    '`access` = excluded.`access`, '
+    '`access_count` = 0'
+)
+# only overwrites an expired row
+_SQL_EX_SET: str = (
+    f'{_SQL_UPSERT} '
+    'WHERE `expire` IS NOT NULL AND `expire` <= ?'
+)
+_SQL_INCR_SELECT: str = (
+    'SELECT `value`, `vf` FROM `cache` '
+    'WHERE `key` = ? AND `tag` IS ? '
+    'AND (`expire` IS NULL OR `expire` > ?)'
+)
+_SQL_INCR: str = (
+    'UPDATE `cache` SET `value` = `value` + ? '
+    'WHERE `key` = ? '
+    'AND `tag` IS ?'
+)
+_SQL_FLUSH_ACCESS: str = (
+    'UPDATE `cache` SET '
+    '`access_count` = `access_count` + ?, '
+    '`access` = MAX(`access`, ?) '
+    'WHERE `rowid` = ?'
+)
+_SQL_CLEAR: str = 'DELETE FROM `cache`'
+_SQL_RESET_COUNT: str = (
+    'UPDATE `info` SET `value` = 0 '
+    'WHERE `key` = "count"'
+)
+_SQL_TTL: str = (
+    'SELECT `expire` '
+    'FROM `cache` '
+    'WHERE `key` = ? '
+    'AND `tag` IS ? '
+    'AND (`expire` IS NULL OR `expire` > ?)'
+)
+_SQL_DELETE: str = (
+    'DELETE FROM `cache` '
+    'WHERE `key` = ? AND `tag` IS ?'
+)
+_SQL_DELETE_SELECT: str = (
+    'SELECT `rowid` '
+    'FROM `cache` '
+    'WHERE `key` = ? AND `tag` IS ?'
+)
+_SQL_INSPECT: str = (
+    'SELECT * '
+    'FROM `cache` '
+    'WHERE `key` = ? AND `tag` IS ?'
+)
+_SQL_POP_SELECT: str = (
+    'SELECT `rowid`, `value`, `vf` '
+    'FROM `cache` '
+    'WHERE `key` = ? '
+    'AND `tag` IS ? '
+    'AND (`expire` IS NULL OR `expire` > ?)'
+)
+_SQL_DELETE_ROWID: str = (
+    'DELETE FROM `cache` '
+    'WHERE `rowid` = ?'
+)
+# the triggers count every row, expired or not, so does the recount
+_SQL_FLUSH_LENGTH: str = (
+    'UPDATE `info` SET `value` = ('
+    'SELECT COUNT(1) FROM `cache`'
+    ') WHERE `key` = "count"'
+)
+_SQL_HAS_KEY: str = (
+    'SELECT 1 FROM `cache` '
+    'WHERE `key` = ? '
+    'AND `tag` IS ? '
+    'AND (`expire` IS NULL OR `expire` > ?)'
+)
+_SQL_TOUCH: str = (
+    'UPDATE `cache` SET `expire` = ? '
+    'WHERE `key` = ? '
+    'AND `tag` IS ? '
+    'AND (`expire` IS NULL OR `expire` > ?)'
+)
+_SQL_DELETE_EXPIRED: str = (
+    'DELETE FROM `cache` '
+    'WHERE `expire` IS NOT NULL '
+    'AND `expire` < ?'
+)
+_SQL_KEYS: str = (
+    'SELECT `rowid`, `key`, `kf`, `tag` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_KEYS_TAG: str = (
+    'SELECT `rowid`, `key`, `kf` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'AND `tag` IS ? '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_VALUES: str = (
+    'SELECT `rowid`, `value`, `vf`, `tag` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_VALUES_TAG: str = (
+    'SELECT `rowid`, `value`, `vf` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'AND `tag` IS ? '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_ITEMS: str = (
+    'SELECT `rowid`, `key`, `kf`, `value`, `vf`, `tag` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_ITEMS_TAG: str = (
+    'SELECT `rowid`, `key`, `kf`, `value`, `vf` '
+    'FROM `cache` '
+    'WHERE `rowid` > ? '
+    'AND (`expire` IS NULL OR `expire` > ?) '
+    'AND `tag` IS ? '
+    'ORDER BY `rowid` '
+    'LIMIT ?'
+)
+_SQL_LENGTH: str = (
+    'SELECT `value` '
+    'FROM `info` '
+    'WHERE `key` = "count"'
+)
+
+
+def _pragma_order(item: Tuple[str, Any]) -> int:
+    """ Sort key placing the `_leading_pragmas` first, others keep their order """
+    try:
+        return _leading_pragmas.index(item[0])
+    except ValueError:
+        return len(_leading_pragmas)
+
+
+def _backoff(timeout: Time) -> Iterable[float]:
+    """ Exponential retry delays, exhausted once ``timeout`` seconds elapsed
+    since the call, not since the first delay is taken
+    """
+    # a generator would only start the clock at the first `next`, after the
+    # first attempt may already have waited `timeout` in the busy handler
+    deadline: float = monotonic() + timeout
+    return _delays(deadline)
+
+
+def _delays(deadline: float) -> Iterable[float]:
+    delay: float = _min_backoff
+    while monotonic() + delay < deadline:
+        yield delay
+        delay = min(delay * 2, _max_backoff)
+
+
+def _mktemp(directory: str) -> Tuple[int, str]:
+    """ Create a new ``.tmp`` file in ``directory``, returns its fd and path.
+    Unlike `mkstemp`, the kernel applies the umask of the moment to its mode
+    """
+    while True:
+        path: str = op.join(directory, f'{urandom(8).hex()}.tmp')
+        try:
+            return os_open(path, _temp_flags, 0o666), path
+        except FileExistsError:
+            continue
+
+
+def _is_locked(exc: OperationalError) -> bool:
+    """ Whether ``exc`` is raised because of a lock held by another connection """
+    return 'locked' in str(exc)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_many_sql(shape: int) -> str:
+    """ Returns the `get_many` statement selecting ``shape`` keys at once """
+    snap: str = ', '.join('?' * shape)
+    return (
+        'SELECT `key`, `value`, `vf` '
+        'FROM `cache` '
+        f'WHERE `key` IN ({snap}) '
+        'AND `tag` IS ? '
+        'AND (`expire` IS NULL OR `expire` > ?)'
+    )
 
 
 class SQLiteManager:
@@ -85,12 +366,15 @@ class SQLiteManager:
         self.name: str = name
         self.timeout: int = timeout
         self.__local: local = local()
-        self.__txn: Optional[int] = None
-        self._txn_id: Optional[int] = None
+        # read only connections, shared by the threads
+        self.__readers: LifoQueue = LifoQueue(maxsize=_reader_pool_size)
+        self.__readers_pid: int = getpid()
         self.__connect_configure: Dict[str, Any] = {
             'database': op.join(self.path, self.name),
             'isolation_level': isolation,
-            'timeout': timeout
+            'timeout': timeout,
+            # keep every hot statement prepared
+            'cached_statements': 256,
         }
         if not isinstance(pragmas, (dict, NoneType)):
             raise TypeError(
@@ -98,7 +382,7 @@ class SQLiteManager:
             )
         self.__pragmas_sql: str = ';'.join(
             f'PRAGMA {item[0]}={item[1]}' for
-            item in (pragmas or _default_pragmas).items()
+            item in sorted((pragmas or _default_pragmas).items(), key=_pragma_order)
         )
         if not self.created:
             init_cache_statements: List[str] = [
@@ -114,10 +398,6 @@ class SQLiteManager:
                 '`access` REAL NOT NULL,'
                 '`access_count` INTEGER DEFAULT 0)',
 
-                # create index
-                'CREATE UNIQUE INDEX IF NOT EXISTS `idx_key` '
-                'ON `cache`(`key`, `tag`)',
-
                 # create info table
                 'CREATE TABLE IF NOT EXISTS `info`('
                 '`key` BLOB NOT NULL, '
@@ -135,13 +415,58 @@ class SQLiteManager:
             init_script: str = ';'.join(init_cache_statements)
             _ = self.session.executescript(init_script)
 
+        if not self._exists('index', 'idx_key_tag'):
+            # also upgrades the databases created with the former `idx_key`
+            # index, which lets NULL tags duplicate and keeps the row count
+            # by hand
+            upgrade_statements: List[str] = [
+                'BEGIN IMMEDIATE',
+                'DROP INDEX IF EXISTS `idx_key`',
+                # the former `idx_lfu` indexed `access`, which the LFU eviction
+                # does not sort by. `LFUEvict.apply` creates it again
+                'DROP INDEX IF EXISTS `idx_lfu`',
+                # keep the latest one of the rows duplicated by NULL tags
+                'DELETE FROM `cache` WHERE `rowid` NOT IN ('
+                f'SELECT MAX(`rowid`) FROM `cache` GROUP BY {_KEY_TAG})',
+
+                # the conflict target of upsert
+                'CREATE UNIQUE INDEX IF NOT EXISTS `idx_key_tag` '
+                f'ON `cache`({_KEY_TAG})',
+
+                # maintain the row count
+                'CREATE TRIGGER IF NOT EXISTS `cache_insert` '
+                'AFTER INSERT ON `cache` BEGIN '
+                "UPDATE `info` SET `value` = `value` + 1 WHERE `key` = 'count'; "
+                'END',
+                'CREATE TRIGGER IF NOT EXISTS `cache_delete` '
+                'AFTER DELETE ON `cache` BEGIN '
+                "UPDATE `info` SET `value` = `value` - 1 WHERE `key` = 'count'; "
+                'END',
+                "UPDATE `info` SET `value` = (SELECT COUNT(1) FROM `cache`) WHERE `key` = 'count'",
+                'COMMIT',
+            ]
+            upgrade_script: str = ';'.join(upgrade_statements)
+            _ = self.session.executescript(upgrade_script)
+
+        if not self._exists('index', 'idx_expire'):
+            # the eviction sweeps the expired rows, only the rows that may
+            # expire are indexed, so that the sweep does not scan the table
+            _ = self.session.execute(
+                'CREATE INDEX IF NOT EXISTS `idx_expire` '
+                'ON `cache`(`expire`) WHERE `expire` IS NOT NULL'
+            )
+
     @property
     def created(self) -> bool:
         """ Determine whether the sqlite schema is created """
+        return self._exists('table', 'cache')
+
+    def _exists(self, kind: str, name: str) -> bool:
+        """ Determine whether the schema object ``name`` of ``kind`` exists """
         row = self.session.execute(
             r'SELECT COUNT(*) FROM sqlite_master '
             r'WHERE `type` = ? AND `name` = ?',
-            ('table', 'cache')
+            (kind, name)
         ).fetchone()
         (count, ) = row
         return count == 1
@@ -150,45 +475,93 @@ class SQLiteManager:
     def session(self) -> Connection:
         """ Create a sqlite connection, every time you get a connection, you need to judge
         whether the current connection is independently occupied by a single thread 
+
+        This is the writer connection, every transaction and write goes through it.
         """
-        local_pid: int = getattr(self.__local, 'pid', -1)
-        current_pid: int = getpid()
-        if local_pid != current_pid:
-            self.close()
-            self.__local.pid = current_pid
-        session: Optional[Connection] = getattr(
-            self.__local, 'session', None
-        )
-        if session is None:
-            session = self.__local.session = Connection(
-                **self.__connect_configure
+        thread_local: local = self.__local
+        # fast path, the connection of this thread is already open
+        if getattr(thread_local, 'pid', -1) == getpid():
+            session: Optional[Connection] = thread_local.session
+            if session is not None:
+                return session
+        return self._connection()
+
+    @contextmanager
+    def reading(self) -> Iterable[Connection]:
+        """ Borrow a read only connection from the pool shared by the threads.
+
+        Under WAL a reader works from its own snapshot, so plain reads on this
+        connection do not wait for a transaction held by the writer connection.
+        Note that it does not see the uncommitted writes of that transaction.
+        Fetch the rows before the block exits, the connection is handed to
+        another thread then.
+        """
+        if self.__readers_pid != getpid():
+            # the connections inherited from the parent process are unusable
+            self.__readers = LifoQueue(maxsize=_reader_pool_size)
+            self.__readers_pid = getpid()
+        readers: LifoQueue = self.__readers
+        try:
+            reader: Connection = readers.get_nowait()
+        except Empty:
+            reader = self._connect(
+                f'{self.__pragmas_sql};PRAGMA query_only=1',
+                check_same_thread=False,
             )
-            start: Time = current()
-            # try to create connection
-            while True:
-                try:
-                    session.executescript(self.__pragmas_sql)
-                    break
-                except OperationalError as exc:
-                    if str(exc) == 'database is locked':
-                        raise
-                    diff: Time = current() - start
-                    if diff > 60:
-                        raise
-                    sleep(0.001)
+        try:
+            yield reader
+        finally:
+            try:
+                readers.put_nowait(reader)
+            except Full:
+                reader.close()
+
+    def _connection(self) -> Connection:
+        thread_local: local = self.__local
+        current_pid: int = getpid()
+        if getattr(thread_local, 'pid', -1) != current_pid:
+            # the connection inherited from the parent process is unusable
+            self._close_local()
+            thread_local.pid = current_pid
+        if thread_local.session is None:
             # cached connection
-            setattr(self.__local, 'session', session)
-        return session
+            thread_local.session = self._connect(self.__pragmas_sql)
+        return thread_local.session
+
+    def _connect(self, pragmas_sql: str, **configure: Any) -> Connection:
+        session: Connection = Connection(**self.__connect_configure, **configure)
+        delays: Iterable[float] = _backoff(60)
+        # try to create connection, `journal_mode` needs a lock the
+        # other connections may hold
+        while True:
+            try:
+                session.executescript(pragmas_sql)
+                return session
+            except OperationalError as exc:
+                delay: Optional[float] = next(delays, None)
+                if not _is_locked(exc) or delay is None:
+                    raise
+                sleep(delay)
 
     def close(self) -> bool:
-        """ Close current active connection """
-        session: Connection = getattr(self.__local, 'session', None)
-        if session is None:
-            return True
-        session.close()
-        setattr(self.__local, 'session', None)
+        """ Close the connection of the current thread and the idle readers """
+        self._close_local()
+        if self.__readers_pid == getpid():
+            while True:
+                try:
+                    self.__readers.get_nowait().close()
+                except Empty:
+                    break
         return True
 
+    def _close_local(self) -> None:
+        session: Optional[Connection] = getattr(self.__local, 'session', None)
+        if session is not None:
+            session.close()
+        # `session` is always set once the pid is, see `_connection`
+        self.__local.session = None
+        self.__local.txn = False
+
     @contextmanager
     def transact(self, retry: bool = True) -> QY:
         """ A context manager that will open a SQLite transaction
@@ -200,35 +573,37 @@ class SQLiteManager:
             return a handle to the transaction.
         """
         sql: QY = self.session.execute
-        tid: int = get_ident()
-        txn_id: Optional[int] = self.__txn
-
-        if tid == txn_id:
-            begin: bool = False
-        else:
+        # the connection is per thread, so is the transaction, the nested
+        # calls join the outer one
+        begin: bool = not getattr(self.__local, 'txn', False)
+        if begin:
+            # the busy handler of the connection already waits for the lock,
+            # this only retries until `timeout` without spinning, counted
+            # from the first attempt
+            delays: Iterable[float] = _backoff(self.timeout)
             while True:
                 try:
                     sql('BEGIN IMMEDIATE')
-                    begin = True
-                    self._txn_id = tid
+                    self.__local.txn = True
                     break
                 except OperationalError as exc:
-                    if retry:
-                        continue
-                    raise TimeoutError(
-                        f'Transact timeout. (timeout={self.timeout}).'
-                    ) from exc
+                    if not _is_locked(exc):
+                        raise
+                    delay: Optional[float] = next(delays, None) if retry else None
+                    if delay is None:
+                        raise TimeoutError(
+                            f'Transact timeout. (timeout={self.timeout}).'
+                        ) from exc
+                    sleep(delay)
         try:
             yield sql
         except BaseException:
             if begin:
-                assert self._txn_id == tid
-                self._txn_id = None
+                self.__local.txn = False
                 sql('ROLLBACK')
             raise
         if begin:
-            assert self._txn_id == tid
-            self._txn_id = None
+            self.__local.txn = False
             sql('COMMIT')
 
     def config(self, key: str, value: Any = empty) -> Any:
@@ -241,22 +616,72 @@ class SQLiteManager:
         # get
         if value is empty:
             row: ROW = self.session.execute(
-                'SELECT `value` ' 
-                'FROM `info` '
-                'WHERE `key` = ?',
+                _SQL_CONFIG_GET,
                 (key, )
             ).fetchone()
             return row[0] if row else None
         # set
         return self.session.execute(
-            'INSERT INTO `info`(`key`, `value`) '
-            'VALUES (?, ?) '
-            'ON CONFLICT (`key`) '
-            'DO UPDATE SET `value` = ? ',
+            _SQL_CONFIG_SET,
             (key, value, value)
         ).rowcount == 1
 
 
+class _HashingSink:
+    """ Writable file object for `pickle.dump`, the written data is kept in
+    memory until it outgrows ``limit`` bytes, then it is spilled into a
+    temporary file of ``directory`` and hashed on the fly.
+    """
+
+    def __init__(self, directory: str, limit: int) -> None:
+        self.directory: str = directory
+        self.limit: int = limit
+        self.buffer: BytesIO = BytesIO()
+        self.hasher = None
+        self.path: Optional[str] = None
+        self._fd = None
+
+    def write(self, data: Any) -> int:
+        # protocol 5 hands the large buffers over as they are, e.g. `PickleBuffer`
+        if self._fd is None:
+            self.buffer.write(data)
+            if self.buffer.tell() >= self.limit:
+                self._spill()
+        else:
+            self.hasher.update(data)
+            self._fd.write(data)
+        return memoryview(data).nbytes
+
+    def _spill(self) -> None:
+        # the inline values are neither hashed nor copied to a file
+        spilled: memoryview = self.buffer.getbuffer()
+        self.hasher = blake2b(spilled, digest_size=16)
+        fd, self.path = _mktemp(self.directory)
+        self._fd = open(fd, 'wb')
+        self._fd.write(spilled)
+        spilled.release()
+        self.buffer = BytesIO()
+
+    def getvalue(self) -> bytes:
+        """ The written data, if it has not been spilled """
+        return self.buffer.getvalue()
+
+    def hexdigest(self) -> str:
+        """ The same as `PickleStore.signature` of the written data """
+        return self.hasher.hexdigest()
+
+    def commit(self, file: str) -> None:
+        """ Move the spilled data to ``file`` """
+        self._fd.close()
+        # atomic, readers never see a partially written file
+        mvfile(self.path, file)
+
+    def discard(self) -> None:
+        if self._fd is not None:
+            self._fd.close()
+            rmfile(self.path)
+
+
 class PickleStore:
     """ Determines how Python objects are stored in the DiskCache.
 
@@ -276,10 +701,25 @@ class PickleStore:
         self.protocol: int = protocol
         self.raw_max_size: int = raw_max_size
         self.charset: str = charset
+        # joined once, the file names are then simply appended
+        self._prefix: str = op.join(directory, '')
+        # keys are serialized by every call, the inline ones are memoized.
+        # `typed`, so that 1 and 1.0 keep their own stored form
+        self._dumps_scalar_key: Callable[[Any], Tuple[Any, int]] = functools.lru_cache(
+            maxsize=_key_cache_size, typed=True
+        )(self.dumps)
+        # the signatures known to be stored, they save the `stat` of writing
+        # the same content again
+        self._stored: Dict[str, None] = {}
+        self._none_key: Tuple[Any, int] = self._dumps_pickle(None)
 
     @staticmethod
     def signature(data: bytes) -> str:
-        return md5(data).hexdigest()
+        """ Content address of ``data``, used as the stored file name. It does
+        not need to be cryptographic, a 128-bit BLAKE2b is faster than md5 and
+        keeps the 32 hex chars names.
+        """
+        return blake2b(data, digest_size=16).hexdigest()
     
     def dumps(self, data: Any) -> Tuple[Any, int]:
         """ Serialize ``data`` to storage formatted
@@ -289,6 +729,10 @@ class PickleStore:
             format: data format
         """
 
+        # None, stored as NULL
+        if data is None:
+            return None, RAW
+
         tp: Type = type(data)
 
         # string
@@ -301,7 +745,11 @@ class PickleStore:
             return sig, STRING
 
         # inf / float
-        if tp in (int, float):
+        if tp is float:
+            return data, NUMBER
+
+        # int, SQLite INTEGER is 64-bit, the larger ones are pickled
+        if tp is int and -(1 << 63) <= data < 1 << 63:
             return data, NUMBER
 
         # bytes
@@ -312,12 +760,52 @@ class PickleStore:
             self.write(sig, data)
             return sig, BYTES
         
-        # pickle
-        pickled: bytes = pickle.dumps(data, protocol=self.protocol)
-        if len(pickled) / 8 < self.raw_max_size:
-            return pickled, PICKLE
-        sig: str = self.signature(pickled)
-        self.write(sig, pickled)
+        return self._dumps_pickle(data)
+
+    def dumps_key(self, key: Any) -> Tuple[Any, int]:
+        """ Serialize ``key`` to storage formatted, the same as ``dumps`` but
+        the key column does not accept NULL, so None is pickled.
+        """
+        tp: Type = type(key)
+        if tp in _scalar_key_types:
+            # memoizing the long keys would pin large objects
+            if (tp is str or tp is bytes) and len(key) > _key_cache_max_length:
+                return self.dumps(key)
+            # nor those stored in files, when `raw_max_size` is below the cap
+            if tp is str and len(key) >= self.raw_max_size:
+                return self.dumps(key)
+            if tp is bytes and len(key) / 8 >= self.raw_max_size:
+                return self.dumps(key)
+            return self._dumps_scalar_key(key)
+        if key is None:
+            return self._none_key
+        return self.dumps(key)
+
+    def lookup_key(self, key: Any) -> Tuple[Any, int]:
+        """ Serialize ``key`` to look it up, the same as ``dumps_key`` but the
+        long str / bytes keys are only hashed, a lookup does not write them.
+        """
+        tp: Type = type(key)
+        if tp is str and len(key) >= self.raw_max_size:
+            return self.signature(key.encode(self.charset)), STRING
+        if tp is bytes and len(key) / 8 >= self.raw_max_size:
+            return self.signature(key), BYTES
+        return self.dumps_key(key)
+
+    def _dumps_pickle(self, data: Any) -> Tuple[Any, int]:
+        # pickle through a hashing sink, the large objects are never
+        # materialized as one bytes object, nor hashed in a second pass
+        sink: _HashingSink = _HashingSink(self.directory, self.raw_max_size * 8)
+        try:
+            pickle.dump(data, sink, protocol=self.protocol)
+        except BaseException:
+            sink.discard()
+            raise
+        if sink.path is None:
+            return sink.getvalue(), PICKLE
+        sig: str = sink.hexdigest()
+        sink.commit(self._prefix + sig)
+        self._remember(sig)
         return sig, PICKLE
 
     def loads(self, dump: Any, fmt: int) -> Any:
@@ -351,24 +839,46 @@ class PickleStore:
         """ write data to file
         
         Args:
-            sig: file name (default md5 value of file content)
+            sig: file name (default signature of file content)
             data: file content 
         """
-        file: str = op.join(self.directory, sig)
+        # the content addressed file is already stored
+        if sig in self._stored:
+            return None
+        file: str = self._prefix + sig
         if op.exists(file):
+            self._remember(sig)
             return None
-        with open(file, 'wb') as fd:
-            _ = fd.write(data)
+        # write aside then move in place, neither the readers nor a
+        # concurrent writer of the same content see a partial file
+        fd, temp = _mktemp(self.directory)
+        try:
+            with open(fd, 'wb') as tmp:
+                _ = tmp.write(data)
+            mvfile(temp, file)
+        except BaseException:
+            rmfile(temp)
+            raise
+        self._remember(sig)
+
+    def _remember(self, sig: str) -> None:
+        """ Record ``sig`` as stored, the record is simply reset once full """
+        if len(self._stored) >= _stored_cache_size:
+            self._stored.clear()
+        self._stored[sig] = None
 
     def read(self, sig: str) -> Optional[bytes]:
 
-        file: str = op.join(self.directory, sig)
+        file: str = self._prefix + sig
         # TODO: the value reference by many key(s)
-        if not op.exists(file):
+        # open it straight away, a missing file is the rare case
+        try:
+            with open(file, 'rb') as fd:
+                return fd.read()
+        except FileNotFoundError:
+            self._stored.pop(sig, None)
             warnings.warn(f'stored file:{file} not found', Cache3Warning)
             return None
-        with open(file, 'rb') as fd:
-            return fd.read()
 
     def delete(self, sig: str) -> bool:
         """ delete cached file
@@ -380,8 +890,9 @@ class PickleStore:
             True if delete success else False
         """
 
+        self._stored.pop(sig, None)
         try:
-            rmfile(op.join(self.directory, sig))
+            rmfile(self._prefix + sig)
             return True
         except OSError:
             return False
@@ -441,7 +952,7 @@ class LFUEvict(EvictInterface):
     def apply(self, sql: QY) -> bool:
         return sql(
             'CREATE INDEX IF NOT EXISTS idx_lfu '
-            'ON cache(`access`)'
+            'ON cache(`access_count`)'
         ).rowcount == 1
 
     def unapply(self, sql: QY) -> bool:
@@ -550,6 +1061,14 @@ class DiskCache:
         self.evict_time: Number = evict_time
         self._evict: Optional[EvictInterface] = None
         self.iter_size: int = iter_size
+        # `get` hits are buffered as {rowid: [count, last access]} and written
+        # back by `flush`, so that reads do not turn into writes
+        self._access_lock: Lock = Lock()
+        self._access_buffer: Dict[int, List[Number]] = {}
+        # estimated row count and writes since it was read, so that writes
+        # only read the real count when the cache may be full
+        self._length_hint: int = 0
+        self._unchecked_writes: int = 0
         
         # config sqlite session manager
         self.sqlite: SQLiteManager = SQLiteManager(
@@ -561,6 +1080,7 @@ class DiskCache:
         )
         # config evict policy
         self.config_evict(evict_policy)
+        self._length_hint = len(self)
         # config pickle storage
         self.store = PickleStore(
             directory=self.directory,
@@ -577,8 +1097,10 @@ class DiskCache:
         if pre_evict_policy != evict_policy:
             pre_evict: EvictInterface = evict_manager[pre_evict_policy]()
             pre_evict.unapply(sql)
-            self._evict.apply(sql)
             self.sqlite.config('evict', evict_policy)
+        # idempotent, it also builds the index of the default policy on a
+        # new database
+        self._evict.apply(sql)
         return True
 
     def set(self, key: Any, value: Any, timeout: Time = None, tag: TG = None) -> bool:
@@ -594,29 +1116,17 @@ class DiskCache:
 
         """
 
-        sk, kf = self.store.dumps(key)
-        with self.sqlite.transact() as sql:
-            row = sql(
-                'SELECT `rowid`'
-                'FROM `cache`'
-                'WHERE `key` = ? AND `tag` IS ?',
-                (sk, tag)
-            ).fetchone()
-            sv, vf = self.store.dumps(value)
-
-            # key existed but it is expired
-            if row:
-                (rowid, ) = row
-                if self._update_row(sql, rowid, sv, vf, timeout, tag):
-                    return True
-
-            # key not found in cache
-            else:
-                ok: bool = self._create_row(sql, sk, kf, sv, vf, timeout, tag)
-                if ok:
-                    self._add_count(sql)
-                    self.try_evict(sql)
-                return ok
+        sk, kf = self.store.dumps_key(key)
+        sv, vf = self.store.dumps(value)
+        now: Time = current()
+        # a single upsert in auto-commit mode, SQLite keeps it atomic
+        session: Connection = self.sqlite.session
+        ok: bool = session.execute(
+            _SQL_UPSERT,
+            (sk, kf, sv, vf, tag, now, get_expire(timeout, now), now)
+        ).rowcount == 1
+        self._maybe_evict(session.execute)
+        return ok
 
     def get(self, key: Any, default: Any = None, tag: TG = None) -> Any:
         """
@@ -629,14 +1139,12 @@ class DiskCache:
         Returns:
 
         """
-        sk, _ = self.store.dumps(key)
-        sql = self.sqlite.session.execute
-        row = sql(
-            'SELECT `rowid`, `value`, `expire`, `vf` '
-            'FROM `cache` '
-            'WHERE `key` = ? AND `tag` IS ?',
-            (sk, tag)
-        ).fetchone()
+        sk, _ = self.store.lookup_key(key)
+        with self.sqlite.reading() as reader:
+            row: ROW = reader.execute(
+                _SQL_GET,
+                (sk, tag)
+            ).fetchone()
 
         if not row:
             # not found key in cache
@@ -649,12 +1157,17 @@ class DiskCache:
             # key has expired
             return default
 
-        sql(
-            'UPDATE `cache` '
-            'SET `access_count` = `access_count` + 1, `access` = ? '
-            'WHERE `rowid` = ?',
-            (now, rowid)
-        )
+        with self._access_lock:
+            buffer: Dict[int, List[Number]] = self._access_buffer
+            hit: Optional[List[Number]] = buffer.get(rowid)
+            if hit is None:
+                buffer[rowid] = [1, now]
+            else:
+                hit[0] += 1
+                hit[1] = now
+            full: bool = len(buffer) >= _access_buffer_size
+        if full:
+            self.flush()
         return self.store.loads(sv, vf)
 
     def get_many(self, keys: List[Any], tag: TG = None) -> Dict[Any, Any]:
@@ -666,22 +1179,54 @@ class DiskCache:
             consistency of behavior
         """
 
-        sks: List[Any] = [self.store.dumps(key)[0] for key in keys]
-        snap: str = str('?, ' * len(sks)).strip(', ')
-        rs: Cursor = self.sqlite.session.execute(
-            'SELECT `key`, `value`, `vf` FROM `cache`'
-            f'WHERE `key` IN ({snap}) AND `tag` IS ? ',
-            (*sks, tag)
-        )
-
-        vs: dict = {sk: self.store.loads(sv, vf) for sk, sv, vf in rs}
+        store: PickleStore = self.store
+        sks: List[Any] = [store.lookup_key(key)[0] for key in keys]
+        now: Time = current()
+        vs: dict = {}
+        limit: int = _batch_shapes[-1]
+        with self.sqlite.reading() as reader:
+            for start in range(0, len(sks), limit):
+                batch: List[Any] = sks[start: start + limit]
+                shape: int = next(size for size in _batch_shapes if size >= len(batch))
+                # pad with NULL, which never matches the `NOT NULL` key column
+                padding: List[None] = [None] * (shape - len(batch))
+                for sk, sv, vf in reader.execute(_get_many_sql(shape), (*batch, *padding, tag, now)):
+                    # the plain columns are the values themselves
+                    vs[sk] = sv if vf == RAW or vf == NUMBER else store.loads(sv, vf)
         result: dict = {}
-        for idx, key in enumerate(keys):
-            v = vs.get(sks[idx], empty)
+        for key, sk in zip(keys, sks):
+            v = vs.get(sk, empty)
             if v is not empty:
                 result[key] = v
         return result
 
+    def set_many(self, mapping: Dict[Any, Any], timeout: Time = None, tag: TG = None) -> bool:
+        """ Set a group of key values under the same tag and timeout.
+
+        All rows are written in a single transaction, so prefer it over
+        calling ``set`` in a loop when writing in bulk.
+        """
+
+        now: Time = current()
+        expire: Time = get_expire(timeout, now)
+        rows: Dict[Any, Tuple[Any, ...]] = {}
+        store: PickleStore = self.store
+        # serialize before entering the transaction, so the write lock is
+        # not held during pickling / file writes
+        for key, value in mapping.items():
+            sk, kf = store.dumps_key(key)
+            sv, vf = store.dumps(value)
+            rows[sk] = (sk, kf, sv, vf)
+
+        with self.sqlite.transact() as sql:
+            self.sqlite.session.executemany(
+                _SQL_UPSERT,
+                ((sk, kf, sv, vf, tag, now, expire, now) for sk, kf, sv, vf in rows.values())
+            )
+            self.try_evict(sql)
+            self._length_hint = self._length(sql)
+        return True
+
     def incr(self, key: Any, delta: Number = 1, tag: TG = None) -> Number:
         """ Increases the value by delta (default 1)
 
@@ -701,12 +1246,10 @@ class DiskCache:
             KeyError: if the key does not exist or has been eliminated
             TypeError: if value is not a number type
         """
-        sk, _ = self.store.dumps(key)
+        sk, _ = self.store.lookup_key(key)
         with self.sqlite.transact() as sql:
             row: ROW = sql(
-                'SELECT `value`, `vf` FROM `cache` '
-                'WHERE `key` = ? AND `tag` IS ? '
-                'AND (`expire` IS NULL OR `expire` > ?)',
+                _SQL_INCR_SELECT,
                 (sk, tag, current())
             ).fetchone()
             if not row:
@@ -721,9 +1264,7 @@ class DiskCache:
                 )
 
             ok: bool = sql(
-                'UPDATE `cache` SET `value`= `value` + ? '
-                'WHERE `key` = ? '
-                'AND `tag` IS ?',
+                _SQL_INCR,
                 (delta, sk, tag)
             ).rowcount == 1
             if not ok:
@@ -735,67 +1276,55 @@ class DiskCache:
     def decr(self, key: Any, delta: Number = 1, tag: TG = None) -> Number:
         return self.incr(key, -delta, tag)
 
-    @staticmethod
-    def _sub_count(sql: QY) -> bool:
-        return sql(
-            'UPDATE `info` SET `value` = `value` - 1 '
-            'WHERE `key` = "count"',
-        ).rowcount == 1
+    def flush(self) -> bool:
+        """ Write the buffered access statistics of `get` hits back to SQLite """
+        if self._access_buffer:
+            with self.sqlite.transact():
+                self._flush_access()
+        return True
 
-    @staticmethod
-    def _add_count(sql: QY) -> bool:
-        return sql(
-            'UPDATE `info` SET `value` = `value` + 1 '
-            'WHERE `key` = "count"'
-        ).rowcount == 1
+    def close(self) -> bool:
+        """ Flush the buffered access statistics and close the current connection """
+        self.flush()
+        return self.sqlite.close()
+
+    def _flush_access(self) -> None:
+        """ Must be called in a transaction """
+        with self._access_lock:
+            if not self._access_buffer:
+                return
+            buffer, self._access_buffer = self._access_buffer, {}
+        self.sqlite.session.executemany(
+            _SQL_FLUSH_ACCESS,
+            ((count, access, rowid) for rowid, (count, access) in buffer.items())
+        )
 
-    @staticmethod
-    def _update_row(sql: QY, rowid: int, sv: Any, vf: int, timeout: Time, tag: TG) -> bool:
-        now: Time = current()
-        expire: Time = get_expire(timeout, now)
-        return sql(
-            'UPDATE `cache` SET '
-            '`value` = ?, '
-            '`vf` = ?, '
-            '`tag` = ?, '
-            '`store` = ?, '
-            '`expire` = ?, '
-            '`access` = ?, '
-            '`access_count` = ? '
-            'WHERE `rowid` = ?',
-            (sv, vf, tag, now, expire, now, 0, rowid)
-        ).rowcount == 1
+    def _discard_access(self, rowid: int) -> None:
+        """ Drop the buffered hits of a deleted row, SQLite may reuse its rowid """
+        with self._access_lock:
+            self._access_buffer.pop(rowid, None)
 
-    # pylint: disable=too-many-arguments
     @staticmethod
-    def _create_row(sql: QY, sk: Any, kf: int, sv: Any, vf: int, timeout: Time, tag: TG) -> bool:
-
-        now: Time = current()
-        expire: Time = get_expire(timeout, now)
-        return sql(
-            'INSERT INTO `cache`('
-            '`key`, `kf`, `value`, `vf`, `tag`, `store`, `expire`, `access`, `access_count`'
-            ') VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-            (sk, kf, sv, vf, tag, now, expire, now, 0)
-        ).rowcount == 1
+    def _length(sql: QY) -> int:
+        (length, ) = sql(_SQL_LENGTH).fetchone()
+        return length if length > 0 else 0
 
     def clear(self) -> bool:
         """ Delete all data and initialize the statistics table. """
 
         with self.sqlite.transact() as sql:
-            sql(
-                'DELETE FROM `cache`;'
-            )
+            sql(_SQL_CLEAR)
             # Delete all data and initialize the statistics table.
             # Since the default `rowid` is used as the primary key,
             # you don't need to care whether the `rowid` starts from
             # 0. Even if the ID is full, SQLite will select an
             # appropriate value from the unused rowid set.
 
-            sql(
-                'UPDATE `info` SET `value` = 0 '
-                'WHERE `key` = "count"'
-            )
+            sql(_SQL_RESET_COUNT)
+        # the buffered hits point at deleted rows, whose rowid will be reused
+        with self._access_lock:
+            self._access_buffer = {}
+        self._length_hint = 0
         return True
 
     @cached_property
@@ -812,21 +1341,19 @@ class DiskCache:
         Returns:
 
         """
-        sk, _ = self.store.dumps(key)
-        row: ROW = self.sqlite.session.execute(
-            'SELECT `expire` '
-            'FROM `cache` '
-            'WHERE `key` = ? '
-            'AND `tag` IS ? '
-            'AND (`expire` IS NULL OR `expire` > ?)',
-            (sk, tag, current())
-        ).fetchone()
+        sk, _ = self.store.lookup_key(key)
+        now: Time = current()
+        with self.sqlite.reading() as reader:
+            row: ROW = reader.execute(
+                _SQL_TTL,
+                (sk, tag, now)
+            ).fetchone()
         if not row:
             return -1
         (expire, ) = row
         if expire is None:
             return None
-        return expire - current()
+        return expire - now
 
     def delete(self, key: Any, tag: TG = None) -> bool:
         """
@@ -839,16 +1366,20 @@ class DiskCache:
 
         """
 
-        sk, _ = self.store.dumps(key)
-        with self.sqlite.transact() as sql:
-            ok: bool = sql(
-                'DELETE FROM `cache` '
-                'WHERE `key` = ? AND `tag` IS ? ',
+        sk, _ = self.store.lookup_key(key)
+        if not self._access_buffer:
+            return self.sqlite.session.execute(
+                _SQL_DELETE,
                 (sk, tag)
             ).rowcount == 1
-            if ok:
-                self._sub_count(sql)
-        return ok
+        # the buffered hits of the row must not land on the row reusing its rowid
+        with self.sqlite.transact() as sql:
+            row: ROW = sql(_SQL_DELETE_SELECT, (sk, tag)).fetchone()
+            if not row:
+                return False
+            success: bool = sql(_SQL_DELETE_ROWID, row).rowcount == 1
+        self._discard_access(row[0])
+        return success
 
     def inspect(self, key: Any, tag: TG = None) -> Optional[Dict[str, Any]]:
         """ Get the details of the key value, including any information,
@@ -856,18 +1387,16 @@ class DiskCache:
         serialized data
         """
 
-        sk, _ = self.store.dumps(key)
-        cursor = self.sqlite.session.execute(
-            'SELECT * '
-            'FROM `cache` '
-            'WHERE `key` = ? AND `tag` IS ?',
-            (sk, tag)
-        )
-        cursor.row_factory = lambda _cursor, _row: {
-            col[0]: _row[idx] for idx, col in enumerate(_cursor.description)
-        }
-        row: Optional[Dict[str, Any]] = cursor.fetchone()
-        if row:
+        sk, _ = self.store.lookup_key(key)
+        with self.sqlite.reading() as reader:
+            cursor = reader.execute(
+                _SQL_INSPECT,
+                (sk, tag)
+            )
+            cursor.row_factory = Row
+            line: Optional[Row] = cursor.fetchone()
+        if line:
+            row: Dict[str, Any] = dict(line)
             row['sk'] = row['key']
             row['key'] = self.store.loads(row['key'], row['kf'])
             row['sv'] = row['value']
@@ -886,13 +1415,9 @@ class DiskCache:
 
         """
         sql: QY = self.sqlite.session.execute
-        sk, _ = self.store.dumps(key)
+        sk, _ = self.store.lookup_key(key)
         row: ROW = sql(
-            'SELECT `rowid`, `value`, `vf` '
-            'FROM `cache` '
-            'WHERE `key` = ? '
-            'AND `tag` IS ? '
-            'AND (`expire` IS NULL OR `expire` > ?)',
+            _SQL_POP_SELECT,
             (sk, tag, current())
         ).fetchone()
         # return the default value if not found key in cache
@@ -901,26 +1426,25 @@ class DiskCache:
         rowid, sv, vf = row
         value = self.store.loads(sv, vf)
         success: bool = sql(
-            'DELETE FROM `cache` '
-            'WHERE `rowid` == ? ',
+            _SQL_DELETE_ROWID,
             (rowid, )
         ).rowcount == 1
-        if success:
-            _ = self._sub_count(sql)
-        else:
+        if not success:
             raise Cache3Error(
                 f'pop error, delete key: {key!r} from cache failed'
             )
+        self._discard_access(rowid)
         return value
 
     def flush_length(self, now: Time = None) -> None:
-        now = now or current()
-        self.sqlite.session.execute(
-            'UPDATE `info` SET `value` = ('
-            'SELECT COUNT(1) FROM `cache` '
-            'WHERE `expire` IS NULL OR `expire` > ? '
-            ') WHERE `key` = "count"', (now,)
-        )
+        """ Sweep the expired rows and count the remaining ones again """
+        if now is None:
+            now = current()
+        with self.sqlite.transact() as sql:
+            sql(_SQL_DELETE_EXPIRED, (now,))
+            # the hits of the swept rows match nothing before a rowid is reused
+            self._flush_access()
+            sql(_SQL_FLUSH_LENGTH)
 
     @property
     def length(self) -> int:
@@ -929,26 +1453,21 @@ class DiskCache:
     
     def has_key(self, key: Any, tag: TG = None) -> bool:
         """ Return True if the key in cache else False. """
-        sk, _ = self.store.dumps(key)
-        return bool(self.sqlite.session.execute(
-            'SELECT 1 FROM `cache` '
-            'WHERE `key` = ? '
-            'AND `tag` IS ? '
-            'AND (`expire` IS NULL OR `expire` > ?)',
-            (sk, tag, current())
-        ).fetchone())
+        sk, _ = self.store.lookup_key(key)
+        with self.sqlite.reading() as reader:
+            return bool(reader.execute(
+                _SQL_HAS_KEY,
+                (sk, tag, current())
+            ).fetchone())
 
     def touch(self, key: Any, timeout: Time = None, tag: TG = None) -> bool:
         """ Renew the key. When the key does not exist, false will be returned """
         now: Time = current()
         new_expire: Time = get_expire(timeout, now)
-        sk, _ = self.store.dumps(key)
+        sk, _ = self.store.lookup_key(key)
         with self.sqlite.transact() as sql:
             return sql(
-                'UPDATE `cache` SET `expire` = ? '
-                'WHERE `key` = ? '
-                'AND `tag` IS ? '
-                'AND (`expire` IS NULL OR `expire` > ?)',
+                _SQL_TOUCH,
                 (new_expire, sk, tag, now)
             ).rowcount == 1
 
@@ -956,108 +1475,110 @@ class DiskCache:
         """ Write the key-value relationship when the data does not exist in the cache,
         otherwise the set operation will be cancelled
         """
-        sk, kf = self.store.dumps(key)
-        with self.sqlite.transact() as sql:
-            row = sql(
-                'SELECT `rowid`, `expire` '
-                'FROM `cache` '
-                'WHERE `key` = ? '
-                'AND `tag` IS ?',
-                (sk, tag)
-            ).fetchone()
-            if row:
-                (rowid, expire) = row
-                if expire is None or expire > current():
-                    return False
-                sv, vf = self.store.dumps(value)
-                return self._update_row(sql, rowid, sv, vf, timeout, tag)
-            sv, vf = self.store.dumps(value)
-            ok: bool = self._create_row(sql, sk, kf, sv, vf, timeout, tag)
-            if ok:
-                self._add_count(sql)
-                self.try_evict(sql)
-            return ok
+        sk, kf = self.store.dumps_key(key)
+        now: Time = current()
+        # a live key makes the serialized value, maybe a stored file, useless.
+        # the upsert still guards against a row written meanwhile
+        with self.sqlite.reading() as reader:
+            if reader.execute(_SQL_HAS_KEY, (sk, tag, now)).fetchone():
+                return False
+        sv, vf = self.store.dumps(value)
+        session: Connection = self.sqlite.session
+        ok: bool = session.execute(
+            _SQL_EX_SET,
+            (sk, kf, sv, vf, tag, now, get_expire(timeout, now), now, now)
+        ).rowcount == 1
+        if ok:
+            self._maybe_evict(session.execute)
+        return ok
+
+    def _maybe_evict(self, sql: QY) -> None:
+        """ Evict in a transaction of its own once the cache is full.
+
+        Updates are counted as insertions, so the estimate only falls behind
+        the rows written by other processes, which `_length_check_interval`
+        bounds.
+        """
+        self._length_hint += 1
+        self._unchecked_writes += 1
+        if self._length_hint < self.max_size and self._unchecked_writes < _length_check_interval:
+            return
+        self._unchecked_writes = 0
+        if self._length(sql) >= self.max_size:
+            with self.sqlite.transact() as transact_sql:
+                self.try_evict(transact_sql)
+        self._length_hint = self._length(sql)
 
     def try_evict(self, sql) -> None:
         """ try to evict expired data """
-        if len(self) < self.max_size:
+        # the reader does not see the writes of this transaction
+        if self._length(sql) < self.max_size:
             return
-        now: Time = current()
+        # the triggers keep the count exact, no need to count the rows again
         sql(
-            'DELETE FROM `cache` '
-            'WHERE `expire` IS NOT NULL '
-            'AND `expire` < ?',
-            (now,)
+            _SQL_DELETE_EXPIRED,
+            (current(),)
         )
-        self.flush_length(now)
-        if len(self) >= self.max_size:
-            _: int = self._evict.evict(sql, self.evict_size)
-            
+        length: int = self._length(sql)
+        if length >= self.max_size:
+            # let the evict policy see the buffered hits
+            self._flush_access()
+            # a bulk write may overshoot `max_size` by far more than `evict_size`
+            _: int = self._evict.evict(sql, length - self.max_size + self.evict_size)
+        # the hits buffered meanwhile for the deleted rows match nothing
+        # before this transaction reuses their rowid
+        self._flush_access()
+
+    def _pages(self, statement: str, *params: Any) -> Iterable[List[ROW]]:
+        """ Yield the rows of ``statement`` page by page, walking the `rowid`
+        keyset, so that each page costs the same however deep it is.
+
+        Every page is fetched at once and the reader goes back to the pool,
+        no statement is left open (pinning its snapshot) while the caller
+        consumes the rows.
+        """
+        now: Time = current()
+        last: int = 0
+        while True:
+            size: int = self.iter_size
+            with self.sqlite.reading() as reader:
+                lines: List[ROW] = reader.execute(
+                    statement,
+                    (last, now, *params, size)
+                ).fetchall()
+            if lines:
+                yield lines
+            if len(lines) < size:
+                return
+            last = lines[-1][0]
+
     def keys(self, tag: TG = empty) -> Iterable[Tuple[Any, str]]:
         """ Returns all keys when tag is specified, otherwise it
         returns both key and tag
         """
-        now: Time = current()
-        n: int = self.length // self.iter_size + 1
-        sql: QY = self.sqlite.session.execute
+        loads: Callable[[Any, int], Any] = self.store.loads
         if tag is empty:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `key`, `kf`, `tag` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'ORDER BY `store` '
-                    'LIMIT ? OFFSET ?',
-                    (now, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line[:2]), line[2]
+            for lines in self._pages(_SQL_KEYS):
+                for _, key, kf, _tag in lines:
+                    yield loads(key, kf), _tag
         else:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `key`, `kf` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'AND `tag` IS ? '
-                    'ORDER BY `store` '
-                    'LIMIT ? OFFSET ?',
-                    (now, tag, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line[:2])
+            for lines in self._pages(_SQL_KEYS_TAG, tag):
+                for _, key, kf in lines:
+                    yield loads(key, kf)
 
     def values(self, tag: TG = empty) -> Iterable[Tuple]:
         """ Returns all values when tag is specified, otherwise it
         returns both value and tag
         """
-        now: Time = current()
-        n: int = self.length // self.iter_size + 1
-        sql: QY = self.sqlite.session.execute
+        loads: Callable[[Any, int], Any] = self.store.loads
         if tag is empty:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `value`, `vf`, `tag` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'ORDER BY `store`'
-                    'LIMIT ? OFFSET ?',
-                    (now, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line[:2]), line[2]
+            for lines in self._pages(_SQL_VALUES):
+                for _, value, vf, _tag in lines:
+                    yield loads(value, vf), _tag
         else:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `value`, `vf` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'AND `tag` IS ? '
-                    'ORDER BY `store` '
-                    'LIMIT ? OFFSET ? ',
-                    (now, tag, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line)
+            for lines in self._pages(_SQL_VALUES_TAG, tag):
+                for _, value, vf in lines:
+                    yield loads(value, vf)
 
     def items(self, tag: TG = empty) -> Iterable[Tuple]:
         """ Returns all key-value relationships under the tag namespace in
@@ -1067,42 +1588,19 @@ class DiskCache:
         Note: that whether tag is specified or not will determine the difference
         in the return value
         """
-        now: Time = current()
-        n: int = self.length // self.iter_size + 1
-        sql: QY = self.sqlite.session.execute
+        loads: Callable[[Any, int], Any] = self.store.loads
         if tag is empty:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `key`, `kf`, `value`, `vf`, `tag` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'ORDER BY `store`'
-                    'LIMIT ? OFFSET ?',
-                    (now, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line[:2]), self.store.loads(*line[2:4]), line[4]
+            for lines in self._pages(_SQL_ITEMS):
+                for _, key, kf, value, vf, _tag in lines:
+                    yield loads(key, kf), loads(value, vf), _tag
         else:
-            for i in range(n):
-                for line in sql(
-                    'SELECT `key`, `kf`, `value`, `vf` '
-                    'FROM `cache` '
-                    'WHERE (`expire` IS NULL OR `expire` > ?) '
-                    'AND `tag` IS ? '
-                    'ORDER BY `store` '
-                    'LIMIT ? OFFSET ?',
-                    (now, tag, self.iter_size, self.iter_size * i)
-                ):
-                    if line:
-                        yield self.store.loads(*line[:2]), self.store.loads(*line[2:])
+            for lines in self._pages(_SQL_ITEMS_TAG, tag):
+                for _, key, kf, value, vf in lines:
+                    yield loads(key, kf), loads(value, vf)
 
     def __len__(self) -> int:
-        (length, ) = self.sqlite.session.execute(
-            'SELECT `value` '
-            'FROM `info` '
-            'WHERE `key` = "count"',
-        ).fetchone()
-        return length if length > 0 else 0
+        with self.sqlite.reading() as reader:
+            return self._length(reader.execute)
 
     def __repr__(self) -> str:
         return f'<DiskCache: {self.location}>'
@@ -84,6 +84,13 @@ class MiniCache:
                     res[key] = self._cache[key]
         return res
 
+    def set_many(self, mapping: Dict[Any, Any], timeout: Time = None) -> bool:
+        expire: Time = get_expire(timeout)
+        with self._lock:
+            for key, value in mapping.items():
+                self._set(key, value, expire)
+        return True
+
     def ex_set(self, key: Any, value: Any, timeout: Time = None) -> bool:
 
         with self._lock:
@@ -208,7 +215,7 @@ class MiniCache:
 
     def _has_expired(self, key: Any, now: Time = None) -> bool:
         exp: Time = self._expires.get(key, -1)
-        return exp is not None and exp < (now or current())
+        return exp is not None and exp < (current() if now is None else now)
 
     def _set(self, key: Any, value: Any, expire: Time) -> None:
         self._cache[key] = value
@@ -271,6 +278,10 @@ class Cache:
         cache = self._caches[tag]
         return cache.get_many(keys)
 
+    def set_many(self, mapping: Dict[Any, Any], timeout: Time = None, tag: TG = None) -> bool:
+        cache = self._caches[tag]
+        return cache.set_many(mapping, timeout)
+
     def ex_set(self, key: Any, value: Any, timeout: Time = None, tag: TG = None) -> bool:
         cache = self._caches[tag]
         return cache.ex_set(key, value, timeout)
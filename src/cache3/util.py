@@ -34,7 +34,9 @@ def get_expire(timeout: Time, now: Time = None) -> Time:
     """ Returns a timestamp representing the timeout time """
     if timeout is None:
         return None
-    return (now or current()) + timeout
+    if now is None:
+        now = current()
+    return now + timeout
 
 
 # pylint: disable=invalid-name
@@ -27,6 +27,9 @@ key_types_cases = [
     # empty
     (empty, 'empty'),
 
+    # None
+    (None, 'none'),
+
     # bool
     (True, 'bool-true'),
     (1, 'bool-true-mess-1'),
@@ -82,6 +85,18 @@ class TestGeneralCacheApi:
             for k, v in cache.get_many(test_set).items():
                 assert k == v[::-1]
 
+    def test_set_many(self):
+        test_set = {key: key[::-1] for key in rand_strings(300)}
+        for cache in self.caches:
+            cache.set('exists', 'old')
+            assert cache.set_many({**test_set, 'exists': 'new'})
+            assert len(cache) == len(test_set) + 1
+            assert cache.get('exists') == 'new'
+            assert cache.get_many(list(test_set)) == test_set
+
+            assert cache.set_many({'expired': 1}, timeout=-1)
+            assert cache.get_many(['expired', 'exists']) == {'exists': 'new'}
+
     def test_clear(self):
         for cache in self.caches:
             cache.clear()
@@ -3,6 +3,7 @@
 # date: 2023/2/15
 # author: clarkmonkey@163.com
 
+import os
 import pickle
 from pathlib import Path
 from shutil import rmtree
@@ -12,9 +13,11 @@ from cache3.disk import (
     SQLiteManager, PickleStore, empty, BYTES, NUMBER, STRING, RAW, PICKLE, EvictManager,
     EvictInterface, LRUEvict, FIFOEvict, LFUEvict, DiskCache
 )
+from cache3 import disk
 from cache3.util import Cache3Error, Cache3Warning
-from sqlite3 import Connection
-from threading import Thread
+from sqlite3 import Connection, OperationalError
+from threading import Thread, Event
+from time import monotonic
 from utils import rand_string, rand_strings
 
 raises = pytest.raises
@@ -22,6 +25,14 @@ warns = pytest.warns
 test_directory = Path('test_directory')
 
 
+def file_mode(mask=None):
+    """ The mode `open` creates the files with under the current umask """
+    if mask is None:
+        mask = os.umask(0)
+        os.umask(mask)
+    return 0o666 & ~mask
+
+
 def setup_module():
     if test_directory.exists():
         rmtree(test_directory.as_posix())
@@ -50,6 +61,24 @@ class TestSQLiteManager:
         test_dir.mkdir(exist_ok=True, parents=True)
         entry = SQLiteManager(test_dir.as_posix(), rand_string(), None, 5)
         assert isinstance(entry.session, Connection)
+        with entry.reading() as reader:
+            assert isinstance(reader, Connection)
+            assert reader is not entry.session
+            with raises(OperationalError, match='readonly'):
+                reader.execute('INSERT INTO `info`(`key`, `value`) VALUES ("k", "v")')
+        # the idle reader is reused, by any thread
+        readers = []
+        def borrow():
+            with entry.reading() as reader:
+                readers.append(reader)
+        t = Thread(target=borrow)
+        t.start()
+        t.join()
+        with entry.reading() as reader:
+            assert readers == [reader]
+            # a concurrent borrower gets another connection
+            with entry.reading() as other:
+                assert other is not reader
         assert entry.close()
 
         def test_multi_threads(sqlite):
@@ -74,6 +103,114 @@ class TestSQLiteManager:
         [t.start() for t in ts]
         [t.join() for t in ts]
     
+    def test_transact(self):
+        test_dir = test_directory / f'test-disk-{rand_string()}'
+        test_dir.mkdir(exist_ok=True, parents=True)
+        name = rand_string()
+        entry = SQLiteManager(test_dir.as_posix(), name, None, 0.05)
+        # nested transactions join the outer one
+        with entry.transact() as sql:
+            with entry.transact() as nested:
+                nested('INSERT INTO `info`(`key`, `value`) VALUES ("k", "v")')
+            assert entry.session.in_transaction
+        assert not entry.session.in_transaction
+        assert entry.config('k') == 'v'
+
+        # rolled back on error
+        with raises(ValueError):
+            with entry.transact() as sql:
+                sql('INSERT INTO `info`(`key`, `value`) VALUES ("k2", "v")')
+                raise ValueError
+        assert entry.config('k2') is None
+
+        # the write lock is held by another connection
+        other = SQLiteManager(test_dir.as_posix(), name, None, 0.05)
+        waiting = SQLiteManager(test_dir.as_posix(), name, None, 0.5)
+        assert waiting.session
+        locked, release = Event(), Event()
+
+        def hold_lock():
+            with other.transact():
+                locked.set()
+                release.wait()
+
+        holder = Thread(target=hold_lock)
+        holder.start()
+        assert locked.wait(5)
+        try:
+            for retry in (True, False):
+                with raises(TimeoutError, match='Transact timeout'):
+                    with entry.transact(retry=retry):
+                        ...
+            # the retries share the `timeout` of the busy handler
+            for retry in (True, False):
+                start = monotonic()
+                with raises(TimeoutError, match='Transact timeout'):
+                    with waiting.transact(retry=retry):
+                        ...
+                assert monotonic() - start < 0.75
+        finally:
+            release.set()
+            holder.join()
+        with entry.transact():
+            ...
+        assert entry.close()
+
+    def test_pragmas(self):
+        test_dir = test_directory / f'test-disk-{rand_string()}'
+        test_dir.mkdir(exist_ok=True, parents=True)
+        entry = SQLiteManager(test_dir.as_posix(), rand_string(), None, 5)
+        assert entry.session.execute('PRAGMA journal_mode').fetchone() == ('wal', )
+        # NORMAL
+        assert entry.session.execute('PRAGMA synchronous').fetchone() == (1, )
+        assert entry.session.execute('PRAGMA page_size').fetchone() == (8192, )
+        assert entry.session.execute('PRAGMA auto_vacuum').fetchone() == (1, )
+        assert entry.session.execute('PRAGMA journal_size_limit').fetchone() == (1 << 23, )
+        assert entry.close()
+
+        # journal mode is applied first even if it is given last
+        entry = SQLiteManager(
+            test_dir.as_posix(), rand_string(), None, 5,
+            pragmas={'synchronous': 'OFF', 'journal_mode': 'wal'}
+        )
+        assert entry.session.execute('PRAGMA journal_mode').fetchone() == ('wal', )
+        assert entry.session.execute('PRAGMA synchronous').fetchone() == (0, )
+        assert entry.close()
+
+    def test_upgrade(self):
+        test_dir = test_directory / f'test-disk-{rand_string()}'
+        test_dir.mkdir(exist_ok=True, parents=True)
+        name = rand_string()
+        entry = SQLiteManager(test_dir.as_posix(), name, None, 5)
+        # roll back to the former schema, which duplicates NULL tags
+        entry.session.executescript(
+            'DROP INDEX `idx_key_tag`;'
+            'DROP TRIGGER `cache_insert`;'
+            'DROP TRIGGER `cache_delete`;'
+            'CREATE UNIQUE INDEX `idx_key` ON `cache`(`key`, `tag`);'
+            'INSERT INTO `cache`(`key`, `kf`, `value`, `vf`, `store`, `access`) '
+            'VALUES ("k", 0, "v1", 0, 0, 0), ("k", 0, "v2", 0, 0, 0);'
+            'INSERT INTO `cache`(`key`, `kf`, `value`, `vf`, `tag`, `store`, `access`) '
+            "VALUES ('k', 0, 'v3', 0, x'', 0, 0);"
+            'CREATE INDEX `idx_lfu` ON `cache`(`access`)'
+        )
+        assert entry.close()
+
+        entry = SQLiteManager(test_dir.as_posix(), name, None, 5)
+        assert entry.session.execute(
+            'SELECT `value` FROM `cache` ORDER BY `rowid`'
+        ).fetchall() == [('v2', ), ('v3', )]
+        assert entry.session.execute(
+            'SELECT `value` FROM `info` WHERE `key` = "count"'
+        ).fetchone() == (2, )
+        # the LFU index is created again on the column it sorts by
+        LFUEvict().apply(entry.session.execute)
+        (lfu, ) = entry.session.execute(
+            'SELECT `sql` FROM sqlite_master WHERE `name` = "idx_lfu"'
+        ).fetchone()
+        assert 'access_count' in lfu
+        assert entry.close()
+
     def test_config(self):
         test_dir = test_directory / f'test-disk-{rand_string()}'
         test_dir.mkdir(exist_ok=True, parents=True)
@@ -105,12 +242,19 @@ class TestPickleStore:
         assert v == store.signature(big_string.encode('UTF-8'))
         assert f == STRING
         assert store.loads(v, f) == big_string
+        assert (test_dir / v).read_bytes() == big_string.encode('UTF-8')
+        assert (test_dir / v).stat().st_mode & 0o777 == file_mode()
+        assert not list(Path(test_dir).glob('*.tmp'))
 
         # int
         v, f = store.dumps(10)
         assert f == NUMBER 
         assert v == 10
         assert store.loads(v, f) == 10
+        v, f = store.dumps(1 << 63)
+        assert f == PICKLE
+        assert store.loads(v, f) == 1 << 63
+        assert store.dumps(-(1 << 63)) == (-(1 << 63), NUMBER)
         
         # float
         v, f = store.dumps(11.)
@@ -129,6 +273,41 @@ class TestPickleStore:
         assert f == BYTES 
         assert store.loads(v, f) == big_bytes
 
+        # None
+        v, f = store.dumps(None)
+        assert f == RAW
+        assert v is None
+        assert store.loads(v, f) is None
+        v, f = store.dumps_key(None)
+        assert f == PICKLE
+        assert store.loads(v, f) is None
+        assert store.dumps_key('key') == store.dumps('key')
+        # memoized keys, only the inline ones
+        assert store.dumps_key(small_string) is store.dumps_key(small_string)
+        memoized = store._dumps_scalar_key.cache_info().currsize
+        assert store.dumps_key(big_string) == store.dumps(big_string)
+        assert store.dumps_key(big_bytes) == store.dumps(big_bytes)
+        assert store._dumps_scalar_key.cache_info().currsize == memoized
+        # the long inline keys are not memoized either
+        inline = self.create_store(test_dir, raw_max_size=1 << 20)
+        for key in ('k' * (disk._key_cache_max_length + 1), b'k' * (disk._key_cache_max_length + 1)):
+            assert inline.dumps_key(key) == (key, RAW)
+        assert inline._dumps_scalar_key.cache_info().currsize == 0
+        assert store.dumps_key(b'key') == (b'key', RAW)
+        assert store.dumps_key(1) == (1, NUMBER)
+        v, f = store.dumps_key(1.)
+        assert type(v) is float and f == NUMBER
+        assert store.dumps_key(True)[1] == PICKLE
+        # a lookup only hashes the long keys
+        long_key = rand_string(11, 20)
+        v, f = store.lookup_key(long_key)
+        assert (v, f) == (store.signature(long_key.encode('UTF-8')), STRING)
+        assert not (test_dir / v).exists()
+        assert store.dumps_key(long_key) == (v, f)
+        assert (test_dir / v).exists()
+        assert store.lookup_key(big_bytes) == store.dumps(big_bytes)
+        assert store.lookup_key('key') == ('key', RAW)
+
         # other type
         v, f = store.dumps(empty)
         assert f == PICKLE 
@@ -137,7 +316,34 @@ class TestPickleStore:
         big_object = list('1' * 100000)
         v, f = store.dumps(big_object)
         assert f == PICKLE
+        assert v == store.signature(pickle.dumps(big_object, protocol=store.protocol))
         assert store.loads(v, f) == big_object
+        # the spilled temporary file has been moved
+        assert not list(Path(test_dir).glob('*.tmp'))
+        # readable by the others, as the umask allows
+        assert (test_dir / v).stat().st_mode & 0o777 == file_mode()
+        # the umask set after the import applies too
+        mask = os.umask(0o077)
+        try:
+            v, f = store.dumps(list('2' * 100000))
+            w, _ = store.dumps(rand_string(11, 20))
+        finally:
+            os.umask(mask)
+        assert (test_dir / v).stat().st_mode & 0o777 == file_mode(0o077) == 0o600
+        assert (test_dir / w).stat().st_mode & 0o777 == 0o600
+
+        # the large buffers are written as `PickleBuffer`
+        buffer = bytearray(rand_string(200, 300).encode('UTF-8'))
+        for data in [pickle.PickleBuffer(buffer), [pickle.PickleBuffer(buffer)] * 2]:
+            v, f = store.dumps(data)
+            assert f == PICKLE
+            assert (test_dir / v).exists()
+        assert store.loads(v, f) == [buffer] * 2
+
+        # failed pickling leaves nothing behind
+        with raises(TypeError):
+            store.dumps([big_object, (i for i in ())])
+        assert not list(Path(test_dir).glob('*.tmp'))
 
         # stored file has been deleted
         v, f = store.dumps(big_string)
@@ -149,6 +355,16 @@ class TestPickleStore:
         assert store.delete(v) == True
         with warns(Cache3Warning):
             assert store.loads(v, f) is None
+        # it is written again
+        assert store.dumps(big_string) == (v, f)
+        assert store.loads(v, f) == big_string
+        # removed behind the store, the failed read forgets it
+        (test_dir / v).unlink()
+        with warns(Cache3Warning):
+            assert store.loads(v, f) is None
+        assert store.dumps(big_string) == (v, f)
+        assert store.loads(v, f) == big_string
+        assert store.delete(v) == True
         
         # test delete
         assert store.delete(v) == False
@@ -232,12 +448,202 @@ class TestDiskCache:
         ins = self.cache.inspect(name, tag=tag)
         assert round(ins['expire'] - ins['store']) == timeout
 
+    def test_pickle_buffer(self):
+        self.cache.set('name', pickle.PickleBuffer(bytearray(200000)))
+        assert self.cache.get('name') == bytearray(200000)
+
+    def test_big_int(self):
+        # wider than SQLite INTEGER, for both keys and values
+        self.cache.set(1 << 64, -(1 << 64))
+        assert self.cache.get(1 << 64) == -(1 << 64)
+        assert self.cache.inspect(1 << 64)['vf'] == PICKLE
+
+    def test_flush(self):
+        name, value = 'name', 'value'
+        self.cache.set(name, value)
+        for _ in range(3):
+            assert self.cache.get(name) == value
+        # hits are buffered until flushed
+        assert self.cache.inspect(name)['access_count'] == 0
+        assert self.cache.flush()
+        assert self.cache.inspect(name)['access_count'] == 3
+        assert self.cache.flush()
+        self.cache.get(name)
+        assert self.cache.close()
+        assert self.cache.inspect(name)['access_count'] == 4
+
+    def test_flush_reused_rowid(self):
+        def deleted(key):
+            return self.cache.delete(key)
+
+        def popped(key):
+            return self.cache.pop(key) == key
+
+        def swept(key):
+            self.cache.flush_length(disk.current() + 10)
+            return not self.cache.has_key(key)
+
+        for remove in [deleted, popped, swept]:
+            self.cache.set('old', 'old', timeout=5)
+            for _ in range(3):
+                assert self.cache.get('old') == 'old'
+            assert remove('old')
+            # the new row takes the rowid of the removed one
+            assert self.cache.set('new', 'new')
+            assert self.cache.flush()
+            assert self.cache.inspect('new')['access_count'] == 0
+            assert self.cache.delete('new')
+
+    def test_count(self):
+        for tag in [None, 'tag']:
+            assert self.cache.set('name', 'value', tag=tag)
+            assert self.cache.set('name', 'value', tag=tag)
+            assert not self.cache.ex_set('name', 'value', tag=tag)
+        assert len(self.cache) == 2
+        assert self.cache.delete('name')
+        assert len(self.cache) == 1
+        assert self.cache.pop('name', tag='tag') == 'value'
+        assert len(self.cache) == 0
+
+        # a NULL tag does not collide with any other tag
+        for tag in [None, b'', 0, '']:
+            assert self.cache.set('name', tag, tag=tag)
+        assert len(self.cache) == 4
+        for tag in [None, b'', 0, '']:
+            assert self.cache.get('name', tag=tag) == tag
+        assert self.cache.set_many({'name': 'value'}, tag=b'')
+        assert self.cache.get('name') is None
+        self.cache.clear()
+
+        # the value of a live key is not even stored
+        assert self.cache.set('name', 'value')
+        directory = Path(self.cache.store.directory)
+        files = len(list(directory.iterdir()))
+        for value in rand_strings(10):
+            assert not self.cache.ex_set('name', value * self.cache.store.raw_max_size)
+        assert len(list(directory.iterdir())) == files
+        self.cache.clear()
+
+        # the expired row is overwritten in place
+        assert self.cache.set('name', 'value', timeout=-1)
+        assert self.cache.ex_set('name', 'new value')
+        assert self.cache.get('name') == 'new value'
+        assert len(self.cache) == 1
+
+        # evicted rows are not counted anymore
+        for key in rand_strings(20):
+            self.cache[key] = key
+        assert len(self.cache) < self.cache.max_size
+
+    def test_flush_length(self):
+        self.cache.max_size = 1 << 10
+        for key in rand_strings(5):
+            self.cache.set(key, key, timeout=-1)
+        for key in rand_strings(5):
+            self.cache.set(key, key)
+        assert self.cache.length == 5
+        self.cache.max_size, self.cache.evict_size = 5, 1
+        with self.cache.sqlite.transact() as sql:
+            self.cache.try_evict(sql)
+        # the count still matches the table after the sweep
+        (rows, ) = self.cache.sqlite.session.execute('SELECT COUNT(1) FROM `cache`').fetchone()
+        assert len(self.cache) == rows == 4
+        self.cache.max_size, self.cache.evict_size = 10, 1 << 6
+
+    def test_set_many_evict(self):
+        self.cache.max_size = 100
+        assert self.cache.set_many({key: key for key in rand_strings(1000)})
+        assert len(self.cache) < self.cache.max_size
+        self.cache.max_size = 10
+
+    def test_length_hint(self, monkeypatch):
+        monkeypatch.setattr(disk, '_length_check_interval', 4)
+        other = DiskCache(self.cache.directory, max_size=1 << 10)
+        for key in rand_strings(20):
+            other[key] = key
+        assert other.close()
+        for key in rand_strings(4):
+            self.cache[key] = key
+        # the rows of the other writer are found by the periodic check
+        assert len(self.cache) < 20
+
+    def test_pages(self):
+        self.cache.max_size = 1 << 10
+        self.cache.iter_size = 4
+        keys = list(rand_strings(10))
+        for key in keys:
+            self.cache.set(key, key[::-1], tag='tag')
+        self.cache.set('expired', 'value', timeout=-1)
+        self.cache.set('name', 'value')
+        assert sorted(self.cache.keys(tag='tag')) == sorted(keys)
+        assert sorted(self.cache.values(tag='tag')) == sorted(key[::-1] for key in keys)
+        assert len(list(self.cache.items())) == 11
+        assert ('name', 'value', None) in list(self.cache.items())
+        # the page starts from the last rowid instead of skipping an offset
+        for statement in ['_SQL_KEYS', '_SQL_VALUES_TAG', '_SQL_ITEMS']:
+            sql = getattr(disk, statement)
+            params = (0, ) * sql.count('?')
+            plan = self.cache.sqlite.session.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            assert 'rowid>?' in plan[0][-1]
+        self.cache.max_size = 10
+        self.cache.iter_size = 1 << 8
+
+    def test_iter_snapshot(self):
+        self.cache.max_size = 1 << 10
+        self.cache.iter_size = 4
+        keys = list(rand_strings(10))
+        for key in keys:
+            self.cache[key] = key
+        iterator = self.cache.keys()
+        assert next(iterator)[0] in keys
+        # a paused iterator does not hide the later writes from this thread
+        self.cache['name'] = 'value'
+        assert self.cache['name'] == 'value'
+        self.cache.max_size = 10
+        self.cache.iter_size = 1 << 8
+
     def test_try_evict(self):
         for evict in ['lru', 'lfu', 'fifo']:
             self.cache.config_evict(evict)
             for key in rand_strings(1000):
                 self.cache[key] = key
 
+    def test_expire_index(self):
+        plan = self.cache.sqlite.session.execute(
+            f'EXPLAIN QUERY PLAN {disk._SQL_DELETE_EXPIRED}', (0, )
+        ).fetchall()
+        assert 'INDEX idx_expire' in plan[0][-1]
+        self.cache.max_size = 1 << 10
+        for key in rand_strings(5):
+            self.cache.set(key, key, timeout=-1)
+        self.cache.set('name', 'value')
+        assert len(self.cache) == 6
+        with self.cache.sqlite.transact() as sql:
+            self.cache.max_size = 6
+            self.cache.try_evict(sql)
+        # only the expired rows are swept
+        assert len(self.cache) == 1
+        assert self.cache.get('name') == 'value'
+        self.cache.max_size = 10
+
+    def test_evict_index(self):
+        for evict, column in [('lru', 'access'), ('lfu', 'access_count'), ('fifo', 'store')]:
+            self.cache.config_evict(evict)
+            plan = self.cache.sqlite.session.execute(
+                'EXPLAIN QUERY PLAN '
+                f'SELECT `rowid` FROM `cache` ORDER BY `{column}` LIMIT 1'
+            ).fetchall()
+            assert f'INDEX idx_{evict}' in plan[0][-1]
+
+    @pytest.mark.parametrize('statement', [
+        '_SQL_GET', '_SQL_HAS_KEY', '_SQL_TTL', '_SQL_DELETE', '_SQL_TOUCH', '_SQL_INCR_SELECT',
+    ])
+    def test_lookup_index(self, statement):
+        sql = getattr(disk, statement)
+        params = (None, ) * sql.count('?')
+        plan = self.cache.sqlite.session.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        assert 'USING INDEX idx_key' in plan[0][-1]
+
     def test_config_evict(self):
         self.cache.config_evict('fifo')
         self.cache.config_evict('lru')
@@ -4,7 +4,7 @@
 # author: clarkmonkey@163.com
 
 import pytest
-from cache3.util import cached_property, lazy, LazyObject
+from cache3.util import cached_property, lazy, LazyObject, get_expire
 raises = pytest.raises
 
 
@@ -176,3 +176,10 @@ class TestCachedProperty:
         new = lazy(A)()
         with raises(AttributeError):
             del new.name
+
+
+def test_get_expire():
+    assert get_expire(None, 10) is None
+    assert get_expire(5, 10) == 15
+    # a bound `now` of zero is used as is
+    assert get_expire(5, 0) == 5